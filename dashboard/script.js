@@ -1,10 +1,133 @@
+// Dashboard server, which forwards job requests to the Python job API.
+var API = "http://localhost:8000";
+var map = null;
+var currentJob = null;
+var currentEvents = null;
+var jobToken = 0;
+var linkLayer = null;
+
+function showStatus(text) {
+  document.getElementById("jobStatus").textContent = text;
+}
+
+// Green when free-flowing, red when jammed.
+function densityColor(ratio) {
+  var r = Math.min(1, Math.max(0, ratio));
+  return "hsl(" + Math.round(120 * (1 - r)) + ", 90%, 45%)";
+}
+
+function clearLinks() {
+  if (linkLayer) {
+    linkLayer.remove();
+    linkLayer = null;
+  }
+}
+
+// Close the current job's event stream and cancel the job if still running.
+function stopJob() {
+  jobToken++;
+  if (currentEvents) {
+    currentEvents.close();
+    currentEvents = null;
+  }
+  if (currentJob) {
+    fetch(API + '/jobs/' + currentJob.id, { method: 'DELETE' }).catch(() => {});
+    currentJob = null;
+  }
+  document.getElementById("cancelJob").hidden = true;
+}
+
+// Start a simulation job and follow its progress as server-sent events.
+function startJob(lat, lon) {
+  stopJob();
+  clearLinks();
+  document.getElementById("jobResult").hidden = true;
+  showStatus("Submitting simulation...");
+  var token = jobToken;
+
+  fetch(API + '/lat?lat=' + lat + '&long=' + lon)
+    .then(response => {
+      if (!response.ok) {
+        return response.text().then(text => { throw new Error(text); });
+      }
+      return response.json();
+    })
+    .then(job => {
+      // Superseded by a newer submission while this one was in flight.
+      if (token !== jobToken) {
+        fetch(API + '/jobs/' + job.id, { method: 'DELETE' }).catch(() => {});
+        return;
+      }
+      currentJob = job;
+      var cancelButton = document.getElementById("cancelJob");
+      cancelButton.hidden = false;
+      var events = new EventSource(API + job.events);
+      currentEvents = events;
+      var links = [];
+      var jamDensity = 1;
+
+      var finish = function(text) {
+        events.close();
+        currentEvents = null;
+        cancelButton.hidden = true;
+        showStatus(text);
+      };
+
+      events.addEventListener("network", function(e) {
+        var n = JSON.parse(e.data);
+        jamDensity = n.jam_density;
+        clearLinks();
+        linkLayer = L.layerGroup().addTo(map);
+        links = n.links.map(l => L.polyline(l[1], { color: densityColor(0), weight: 3 })
+          .bindTooltip(l[0])
+          .addTo(linkLayer));
+      });
+      events.addEventListener("progress", function(e) {
+        var p = JSON.parse(e.data);
+        if (p.stage === "simulate") {
+          showStatus("Simulating: " + p.time + " / " + p.tmax + " s, " + p.vehicles + " vehicles in network");
+        } else {
+          showStatus("Stage: " + p.stage);
+        }
+      });
+      events.addEventListener("frame", function(e) {
+        var f = JSON.parse(e.data);
+        f.density.forEach((k, i) => links[i].setStyle({ color: densityColor(k / jamDensity) }));
+      });
+      events.addEventListener("done", function(e) {
+        var r = JSON.parse(e.data);
+        finish("Done: " + r.metrics.trip_completed + " / " + r.metrics.trip_all + " trips completed, average delay " + r.metrics.average_delay.toFixed(1) + " s");
+        var img = document.getElementById("jobResult");
+        img.src = API + r.gif;
+        img.hidden = false;
+      });
+      events.addEventListener("failed", function(e) {
+        finish("Simulation failed: " + JSON.parse(e.data).error);
+      });
+      events.addEventListener("cancelled", function() {
+        finish("Simulation cancelled.");
+      });
+    })
+    .catch(err => {
+      if (token === jobToken) {
+        showStatus("Could not start simulation: " + err.message);
+      }
+    });
+}
+
+document.getElementById("cancelJob").addEventListener("click", function() {
+  if (currentJob) {
+    fetch(API + '/jobs/' + currentJob.id, { method: 'DELETE' }).catch(() => {});
+  }
+});
+
 document.getElementById("locationForm").addEventListener("submit", function(event) {
     event.preventDefault();
     var location = document.getElementById("locationInput").value;
 
     // Initialize the Leaflet map (if needed)
     if (!map) {
-      var map = L.map('map').setView([41.4549665, -70.5606838], 13); 
+      map = L.map('map').setView([41.4549665, -70.5606838], 13); 
       L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
         attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
       }).addTo(map); 
@@ -19,6 +142,7 @@ document.getElementById("locationForm").addEventListener("submit", function(even
           var lon = data[0].lon;
           map.setView([lat, lon], 13); 
           L.marker([lat, lon]).addTo(map); 
+          startJob(lat, lon);
         } else {
           alert("Location not found."); 
         }
@@ -1,33 +1,38 @@
 import { serve, ServerRequest } from "https://deno.land/std/http/server.ts";
+import { readerFromStreamReader } from "https://deno.land/std/streams/conversion.ts";
 
-const getAddress = (url: URL) => {
-  return url.searchParams.get("addr");
-};
+// Python job API (jobs.py) that runs the simulations.
+const JOB_API = Deno.env.get("JOB_API") ?? "http://localhost:8001";
 
-const getLatitudeAndLongitude = (url: URL) => {
-  return {
-    latitude: url.searchParams.get("lat"),
-    longitude: url.searchParams.get("long")
-  };
+const isJobEndpoint = (url: URL) => {
+  return url.pathname === "/addr" || url.pathname === "/lat" ||
+    url.pathname === "/jobs" || url.pathname.startsWith("/jobs/");
 };
 
+// Forward the request, streaming the body so server-sent events pass through.
+async function proxy(req: ServerRequest, url: URL) {
+  try {
+    const res = await fetch(JOB_API + url.pathname + url.search, {
+      method: req.method,
+    });
+    await req.respond({
+      status: res.status,
+      headers: res.headers,
+      body: res.body ? readerFromStreamReader(res.body.getReader()) : undefined,
+    });
+  } catch (e) {
+    await req.respond({ status: 502, body: `Job API unavailable: ${e}` });
+  }
+}
+
 async function handleRequest(req: ServerRequest) {
   const url = new URL(req.url, `http://${req.headers.get("host")}/`);
-  let response: string;
 
-  if (url.pathname === "/addr") {
-    const address = getAddress(url);
-    response = address ? `Address: ${address}` : "Please provide an address.";
-  } else if (url.pathname === "/lat") {
-    const { latitude, longitude } = getLatitudeAndLongitude(url);
-    response = latitude && longitude
-      ? `Latitude: ${latitude}, Longitude: ${longitude}`
-      : "Please provide both latitude and longitude.";
+  if (isJobEndpoint(url)) {
+    await proxy(req, url);
   } else {
-    response = "Invalid API endpoint.";
+    req.respond({ body: "Invalid API endpoint." });
   }
-
-  req.respond({ body: response });
 };
 
 const PORT = 8000;
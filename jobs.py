@@ -0,0 +1,419 @@
+"""
+Asynchronous simulation jobs served over HTTP.
+
+`/addr?addr=...` and `/lat?lat=...&long=...` queue a job and return at once.
+Progress, downsampled link-density frames and the final result are streamed
+as server-sent events from `/jobs/<id>/events`; the animation of a finished
+job is served from `/jobs/<id>/gif`, and `DELETE /jobs/<id>` cancels.
+dashboard/server.ts forwards these endpoints here.
+
+The fetch, demands and render stages run in a forked child process that is
+killed on cancel. The simulate stage runs in the worker and stops at its next
+progress checkpoint, at most PROGRESS_INTERVAL simulated seconds away.
+"""
+
+import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# main first: its logging.basicConfig must run before inout's DEBUG one.
+from main import SIMULATION_DURATION, render, routine
+import osm2csv as ocv
+import surrogate
+from inout import gen_csv
+
+logger = logging.getLogger(__name__)
+
+#########SETTINGS########################
+
+PORT = 8001
+
+WORKERS = 1
+# Jobs share osm/ exports and osm2csv settings, so only one may run at a time.
+
+MAX_FRAME_LINKS = 200
+# Links included in each density frame.
+
+KEEPALIVE_SECS = 15
+
+CANCEL_POLL_SECS = 0.5
+# How often a job waiting on a child process checks for cancellation.
+
+JOB_TTL_SECS = 3600
+MAX_FINISHED_JOBS = 50
+# Finished jobs are forgotten after JOB_TTL_SECS; at most MAX_FINISHED_JOBS kept.
+
+GIF_PATH = "out/anim_network0.gif"
+# Where main.render writes the animation; copied per job once done.
+
+##########################################
+
+TERMINAL = {"done", "failed", "cancelled"}
+
+JOBS = {}
+JOBS_LOCK = threading.Lock()
+QUEUE = queue.Queue()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, query):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.query = query
+        self.status = "queued"
+        self.stage = None
+        self.progress = {}
+        self.events = []
+        self.cancel_requested = False
+        self.loc = None
+        self.frame_links = None
+        self.finished_at = None
+        self.cond = threading.Condition()
+
+    def publish(self, event, data):
+        with self.cond:
+            self.events.append((event, data))
+            self.cond.notify_all()
+
+    def set_stage(self, stage, **progress):
+        with self.cond:
+            self.status = "running"
+            self.stage = stage
+            self.progress = progress
+            self.publish("progress", {"stage": stage, **progress})
+
+    def finish(self, status, **data):
+        with self.cond:
+            self.status = status
+            self.finished_at = time.monotonic()
+            self.publish(status, data)
+
+    @property
+    def gif_path(self):
+        return os.path.join("out", f"job_{self.id}.gif")
+
+    def check(self):
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "query": self.query,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "events": f"/jobs/{self.id}/events",
+        }
+
+
+def sampled_links(W):
+    """
+    At most MAX_FRAME_LINKS evenly spaced links, the same on every frame.
+    """
+    stride = max(1, math.ceil(len(W.LINKS) / MAX_FRAME_LINKS))
+    return W.LINKS[::stride]
+
+
+def link_geometry(link, center):
+    return [
+        ocv.global_coords((n.x, n.y), center)
+        for n in (link.start_node, link.end_node)
+    ]
+
+
+def on_progress(job, W):
+    job.check()
+    if job.frame_links is None:
+        # Sent once, so frames only need to carry densities, in this order.
+        job.frame_links = sampled_links(W)
+        job.publish(
+            "network",
+            {
+                "jam_density": ocv.GLOBAL_MEAN_JAM_DENSITY,
+                "links": [
+                    [l.name, link_geometry(l, job.loc)] for l in job.frame_links
+                ],
+            },
+        )
+    job.set_stage(
+        "simulate",
+        time=W.TIME,
+        tmax=W.TMAX,
+        vehicles=len(W.VEHICLES_RUNNING),
+    )
+    job.publish(
+        "frame",
+        {"time": W.TIME, "density": [round(l.density, 4) for l in job.frame_links]},
+    )
+
+
+def _child(send, fn, args):
+    try:
+        send.send((True, fn(*args)))
+    except Exception as e:
+        send.send((False, f"{type(e).__name__}: {e}"))
+
+
+def run_killable(job, fn, *args):
+    """
+    Run fn(*args) in a forked child process and return its result, killing
+    the child if the job is cancelled meanwhile. Forking lets the child use
+    the worker's state (e.g. a World) without pickling it.
+    """
+    ctx = multiprocessing.get_context("fork")
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(send, fn, args), daemon=True)
+    proc.start()
+    send.close()
+
+    try:
+        while not recv.poll(CANCEL_POLL_SECS):
+            if job.cancel_requested:
+                proc.kill()
+                raise JobCancelled()
+            if not proc.is_alive() and not recv.poll():
+                raise RuntimeError(f"{fn.__name__} exited with code {proc.exitcode}")
+        ok, value = recv.recv()
+    finally:
+        proc.join()
+        recv.close()
+
+    if not ok:
+        raise RuntimeError(value)
+    return value
+
+
+def run_job(job):
+    try:
+        job.check()
+        job.set_stage("fetch")
+        if job.kind == "addr":
+            loc = run_killable(job, ocv.process_address, job.query["addr"])
+        else:
+            loc = run_killable(
+                job, ocv.process_coords, (job.query["lat"], job.query["long"])
+            )
+        job.loc = loc
+        job.check()
+
+        job.set_stage("demands")
+        run_killable(job, gen_csv, loc, "raw_demands.csv", "any")
+        job.check()
+
+        job.set_stage("simulate", time=0, tmax=SIMULATION_DURATION, vehicles=0)
+        W = routine(loc, on_progress=lambda W: on_progress(job, W), anim=False)
+        job.check()
+
+        job.set_stage("render")
+        run_killable(job, render, W)
+        job.check()
+        # The next job overwrites GIF_PATH, so keep a copy for this one.
+        shutil.copyfile(GIF_PATH, job.gif_path)
+        job.finish(
+            "done", gif=f"/jobs/{job.id}/gif", metrics=surrogate.run_metrics(W)
+        )
+    except JobCancelled:
+        logger.info(f"Job {job.id} cancelled.")
+        job.finish("cancelled")
+    except Exception as e:
+        logger.exception(f"Job {job.id} failed.")
+        job.finish("failed", error=str(e))
+    finally:
+        job.frame_links = None
+
+
+def worker():
+    while True:
+        job = QUEUE.get()
+        with job.cond:
+            # Cancelled while still queued.
+            if job.status != "queued":
+                continue
+            job.status = "running"
+        run_job(job)
+
+
+def evict():
+    """
+    Forget finished jobs older than JOB_TTL_SECS, and all but the newest
+    MAX_FINISHED_JOBS, along with their buffered events and animations.
+    """
+    now = time.monotonic()
+    with JOBS_LOCK:
+        finished = sorted(
+            (j for j in JOBS.values() if j.finished_at is not None),
+            key=lambda j: j.finished_at,
+        )
+        stale = [j for j in finished if now - j.finished_at > JOB_TTL_SECS]
+        stale += [j for j in finished if j not in stale][:-MAX_FINISHED_JOBS]
+        for job in stale:
+            del JOBS[job.id]
+
+    for job in stale:
+        if os.path.exists(job.gif_path):
+            os.remove(job.gif_path)
+    if stale:
+        logger.info(f"Evicted {len(stale)} finished jobs.")
+
+
+def submit(kind, query):
+    evict()
+    job = Job(kind, query)
+    with JOBS_LOCK:
+        JOBS[job.id] = job
+    QUEUE.put(job)
+    logger.info(f"Queued job {job.id}: {kind} {query}")
+    return job
+
+
+def cancel(job):
+    with job.cond:
+        job.cancel_requested = True
+        if job.status == "queued":
+            job.finish("cancelled")
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        logger.info(fmt % args)
+
+    def cors(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, DELETE, OPTIONS")
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.cors()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def find_job(self, parts):
+        with JOBS_LOCK:
+            job = JOBS.get(parts[1]) if len(parts) > 1 else None
+        if job is None:
+            self.reply(404, {"error": "No such job."})
+        return job
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.cors()
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+
+        if url.path == "/addr":
+            if not params.get("addr"):
+                return self.reply(400, {"error": "Please provide an address."})
+            return self.reply(202, submit("addr", {"addr": params["addr"]}).summary())
+
+        if url.path == "/lat":
+            try:
+                query = {"lat": float(params["lat"]), "long": float(params["long"])}
+            except (KeyError, ValueError):
+                return self.reply(
+                    400, {"error": "Please provide both latitude and longitude."}
+                )
+            return self.reply(202, submit("lat", query).summary())
+
+        if url.path == "/jobs":
+            with JOBS_LOCK:
+                jobs = list(JOBS.values())
+            return self.reply(200, [j.summary() for j in jobs])
+
+        if parts[0] == "jobs" and len(parts) in (2, 3):
+            job = self.find_job(parts)
+            if job is None:
+                return
+            if len(parts) == 2:
+                return self.reply(200, job.summary())
+            if parts[2] == "events":
+                return self.stream_events(job)
+            if parts[2] == "gif":
+                return self.send_gif(job)
+
+        self.reply(404, {"error": "Invalid API endpoint."})
+
+    def do_DELETE(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts[0] != "jobs" or len(parts) != 2:
+            return self.reply(404, {"error": "Invalid API endpoint."})
+        job = self.find_job(parts)
+        if job is not None:
+            cancel(job)
+            self.reply(202, job.summary())
+
+    def send_gif(self, job):
+        if job.status != "done" or not os.path.exists(job.gif_path):
+            return self.reply(404, {"error": "No animation for this job."})
+        with open(job.gif_path, "rb") as f:
+            data = f.read()
+        self.send_response(200)
+        self.cors()
+        self.send_header("Content-Type", "image/gif")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_events(self, job):
+        self.send_response(200)
+        self.cors()
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        sent = 0
+        try:
+            while True:
+                with job.cond:
+                    if sent == len(job.events):
+                        job.cond.wait(KEEPALIVE_SECS)
+                    new = job.events[sent:]
+                    sent = len(job.events)
+                    done = job.status in TERMINAL
+
+                if not new:
+                    self.wfile.write(b": keepalive\n\n")
+                for event, data in new:
+                    self.wfile.write(
+                        f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+                    )
+                self.wfile.flush()
+                if done:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info(f"Event stream for job {job.id} closed by client.")
+
+
+def serve(port=PORT):
+    for _ in range(WORKERS):
+        threading.Thread(target=worker, daemon=True).start()
+    server = ThreadingHTTPServer(("", port), Handler)
+    server.daemon_threads = True
+    logger.info(f"Job API running on port {port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.getLogger(__name__).setLevel(logging.INFO)
+    serve()
@@ -1,8 +1,10 @@
 from uxsim import *
 import csv
 import logging
+import random
 from demparser import parse_demands
 import osm2csv as ocv
+import surrogate
 import argparse
 
 logging.basicConfig(level=logging.CRITICAL)
@@ -11,6 +13,9 @@ logger = logging.getLogger(__name__)
 SIMULATION_DURATION = 2 * 3600
 # Simulate 2 hours worth of traffic.
 
+PROGRESS_INTERVAL = 300
+# Simulated seconds between progress callbacks.
+
 
 def gen_links_from_csv(W, fname):
     """
@@ -45,7 +50,18 @@ def gen_links_from_csv(W, fname):
         )
 
 
-def routine(loc):
+def render(W):
+    logger.info("Creating anim...")
+    W.analyzer.network_anim(network_font_size=1, maxwidth=6)
+    logger.info("Finished creating animation")
+
+
+def routine(loc, on_progress=None, anim=True):
+    """
+    Build the world from the exported OSM data and simulate it.
+    If given, on_progress(W) is called every PROGRESS_INTERVAL simulated
+    seconds; an exception raised from it aborts the run.
+    """
 
     W = World(
         name="",  # Scenario name
@@ -92,10 +108,20 @@ def routine(loc):
 
     logger.info(f"Added a random demand as well: {src} -> {dst}")
 
-    W.exec_simulation()
-    logger.info("Creating anim...")
-    W.analyzer.network_anim(network_font_size=1, maxwidth=6)
-    logger.info("Finished creating animation")
+    if on_progress is None:
+        W.exec_simulation()
+    else:
+        while W.check_simulation_ongoing():
+            W.exec_simulation(duration_t2=PROGRESS_INTERVAL)
+            on_progress(W)
+
+    surrogate.record_run(
+        surrogate.current_params(),
+        surrogate.network_features(),
+        surrogate.run_metrics(W),
+    )
+    if anim:
+        render(W)
     return W
 
 
@@ -111,6 +137,29 @@ def main():
         help="Latitude and Longitude of Place.",
     )
 
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Only regenerate edges that changed since the previous export.",
+    )
+
+    parser.add_argument(
+        "-s",
+        "--streaming",
+        action="store_true",
+        help="Stream the export in chunks with bounded memory (for large areas).",
+    )
+    parser.add_argument(
+        "-m",
+        "--memory-limit",
+        type=int,
+        default=ocv.EXPORT_MEMORY_LIMIT_MB,
+        metavar="MB",
+        help="Memory ceiling for --streaming exports (the OSM download itself "
+        "is not covered).",
+    )
+
     # Optional argument to run the built-in test routine
     parser.add_argument(
         "-t",
@@ -124,10 +173,14 @@ def main():
     logger.debug(f"Received args: {args}.")
 
     if args.address:
-        ocv.process_address(args.address)
+        ocv.process_address(
+            args.address, args.incremental, args.streaming, args.memory_limit
+        )
         routine()
     elif args.coordinates:
-        ocv.process_coords(args.coordinates)
+        ocv.process_coords(
+            args.coordinates, args.incremental, args.streaming, args.memory_limit
+        )
         routine()
     elif args.testrun:
         routine()
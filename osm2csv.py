@@ -1,5 +1,11 @@
 from collections import namedtuple
+from itertools import islice
+import csv
+import hashlib
+import os
 import random
+import sys
+import numpy as np
 import osmnx as ox
 import pandas as pd
 import logging
@@ -42,6 +48,49 @@ FREEFLOW_MEAN_SHIFTCOEF = 0.0025
 
 HEAVY_PRUNE = False
 
+ATTRIBUTE_SEED = 0
+# Seed for per-edge attribute generation; same seed, same export.
+
+EXPORT_CHUNK_SIZE = 50_000
+# Rows written per chunk by the streaming exporter.
+
+EXPORT_MEMORY_LIMIT_MB = 2048
+# Memory ceiling for the streaming exporter: downloaded graph, compaction and
+# buffers. The OSM download and graph build by OSMnx come first and are not
+# covered; the exporter refuses graphs whose export would exceed it.
+
+ROW_BYTES_ESTIMATE = 1024
+# Rough in-memory footprint of one buffered row (tuple, strings, dict).
+
+GRAPH_NODE_BYTES = 512
+GRAPH_EDGE_BYTES = 704
+# Footprint of one node/edge of the downloaded MultiDiGraph with tags trimmed
+# as below, geometry dropped (tracemalloc measured ~490 and ~680 bytes).
+
+INDEX_ENTRY_BYTES = 128
+# Rough footprint of one node id -> index entry while compacting.
+
+NAME_BYTES_ESTIMATE = 96
+# Rough footprint of one distinct highway/street name string.
+
+USEFUL_TAGS_WAY = ["highway", "name", "oneway", "junction"]
+# Way tags kept at download time; oneway/junction decide edge direction.
+
+ox.settings.useful_tags_way = USEFUL_TAGS_WAY
+ox.settings.useful_tags_node = []
+
+EDGE_COLUMNS = [
+    "name",
+    "source",
+    "target",
+    "length",
+    "free_flow_speed",
+    "jam_density",
+    "merge_priority",
+    "st_name",
+    "signature",
+]
+
 """
 IMPL Ideas:
     1. Ditch Global jam denstiy - and use a better model per street.
@@ -77,6 +126,18 @@ def local_coords(p1, p0, R=6_366_707):
     return (dy, dx)
 
 
+def global_coords(p1, p0, R=6_366_707):
+    """
+    Inverse of local_coords: (lat, lon) of local co-ords p1 = (dy, dx) around p0.
+    """
+
+    theta = p0[0] * math.pi / 180
+    dy, dx = p1
+    lat = p0[0] + dy / R * 180 / math.pi
+    lon = p0[1] + dx / (R * math.cos(theta)) * 180 / math.pi
+    return (lat, lon)
+
+
 def get_lat_lon(location_name):
     """
     Get latitude and longitude details of a location using OpenStreetMap via OSMnx.
@@ -102,22 +163,102 @@ def node_proc(nodes_iter, center):
         yield (node[0], *local_coords(p1, center))
 
 
-def edge_proc(edges_iter):
+def tag_str(value):
+    """
+    Canonical string for an OSM tag. Simplified edges merging several ways
+    get a list of their values, in set order, which varies between runs.
+    """
+    if isinstance(value, list):
+        return str(sorted(str(x) for x in value))
+    return str(value)
+
+
+def link_name(u, v, key):
+    """
+    Stable link id for an OSM edge, independent of graph iteration order.
+    """
+    return f"E{u}_{v}_{key}"
+
+
+def edge_rng(u, v, key, seed=None):
+    """
+    Random generator keyed deterministically on (u, v, key, seed).
+    """
+    if seed is None:
+        seed = ATTRIBUTE_SEED
+    digest = hashlib.sha1(f"{u},{v},{key},{seed}".encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def edge_signature(edge, seed=None):
+    """
+    Digest of everything an edge's exported row depends on.
+    If it matches the previous export, the row can be reused as-is.
+    """
+    if seed is None:
+        seed = ATTRIBUTE_SEED
+    u, v, key, data = edge
+    parts = (
+        u,
+        v,
+        key,
+        float(data["length"]),
+        tag_str(data["highway"]),
+        tag_str(data.get("name", "unnamed")),
+        FREE_FLOW_SPEED_MAP.get(tag_str(data["highway"]), DEFAULT_FREE_FLOW_SPEED),
+        seed,
+        FUDGE_IDEAL_VALUES,
+        GLOBAL_MEAN_JAM_DENSITY,
+        JAM_DENSITY_VARIANCE,
+        FREEFLOW_SPEED_VARIANCE,
+        FREEFLOW_MEAN_SHIFTCOEF,
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+def load_previous_edges(filename):
+    """
+    Load a previous edges export as {name: row}, or {} if there is none.
+    """
+    fp = f"{filename}_edges.csv"
+    if not os.path.exists(fp):
+        return {}
+    with open(fp, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header != EDGE_COLUMNS:
+            logger.info(f"{fp} predates signatures, doing a full export.")
+            return {}
+        return {r[0]: tuple(r) for r in reader}
+
+
+def edge_proc(edges_iter, previous=None):
     """
     Obtain edges from OSM and export it.
+    Expects edges as (u, v, key, data), sorted by (u, v, key) for a stable export.
+    Rows in `previous` whose signature still matches are reused unchanged.
     Future Improvement - Add method to infer jam density.
     """
 
-    for i, edge in enumerate(edges_iter):
-        name = f"E{i}"
-        road_len = float(edge[2]["length"])
-        rtype = str(edge[2]["highway"])
+    previous = previous or {}
+
+    for edge in edges_iter:
+        u, v, key, data = edge
+        name = link_name(u, v, key)
+        road_len = float(data["length"])
+        rtype = tag_str(data["highway"])
 
         # Probably not necessary, but keeping it here for paranioa's sake.
         if rtype in PRUNE_SET:
             continue
 
-        if HEAVY_PRUNE and "name" not in edge[2]:
+        if HEAVY_PRUNE and "name" not in data:
+            continue
+
+        sig = edge_signature(edge)
+        old = previous.get(name)
+        if old is not None and old[-1] == sig:
+            yield old
             continue
 
         logger.info(f"{name} : {edge}")
@@ -126,50 +267,58 @@ def edge_proc(edges_iter):
             FREE_FLOW_SPEED_MAP.get(rtype, DEFAULT_FREE_FLOW_SPEED)
         )
         if FUDGE_IDEAL_VALUES:
-            free_flow = random.gauss(
+            rng = edge_rng(u, v, key)
+            free_flow = rng.gauss(
                 defined_free_flow + (FREEFLOW_MEAN_SHIFTCOEF) * road_len,
                 FREEFLOW_SPEED_VARIANCE,
             )
-            jd = random.gauss(GLOBAL_MEAN_JAM_DENSITY, JAM_DENSITY_VARIANCE)
+            jd = rng.gauss(GLOBAL_MEAN_JAM_DENSITY, JAM_DENSITY_VARIANCE)
         else:
             free_flow = defined_free_flow
             jd = GLOBAL_MEAN_JAM_DENSITY
 
         yield (
             name,
-            edge[0],
-            edge[1],
+            u,
+            v,
             road_len,
             free_flow,
             jd,
             1,
-            edge[2].get("name", "unnamed"),
+            tag_str(data.get("name", "unnamed")),
+            sig,
         )
 
 
-def export_to_csv(graph, center, filename):
+def export_to_csv(graph, center, filename, incremental=False):
     """
     Export graphs into two csv files
+    With incremental=True, only edges added or changed since the previous
+    export at `filename` are regenerated.
     """
 
-    a = node_proc(graph.nodes(data=True), center)
-    b = edge_proc(graph.edges(data=True))
+    previous = load_previous_edges(filename) if incremental else {}
 
-    nodes_df = pd.DataFrame(a, columns=["node_id", "x", "y"])
-    edges_df = pd.DataFrame(
-        b,
-        columns=[
-            "name",
-            "source",
-            "target",
-            "length",
-            "free_flow_speed",
-            "jam_density",
-            "merge_priority",
-            "st_name",
-        ],
+    a = node_proc(sorted(graph.nodes(data=True), key=lambda n: n[0]), center)
+    b = edge_proc(
+        sorted(graph.edges(keys=True, data=True), key=lambda e: e[:3]), previous
     )
 
+    nodes_df = pd.DataFrame(a, columns=["node_id", "x", "y"])
+    edges_df = pd.DataFrame(b, columns=EDGE_COLUMNS)
+
+    if incremental:
+        names = set(edges_df["name"])
+        kept = {n for n, r in previous.items() if n in names}
+        reused = sum(
+            1 for r in edges_df.itertuples(index=False) if previous.get(r[0]) == r
+        )
+        logger.info(
+            f"Incremental export: {len(names - kept)} added, "
+            f"{len(previous) - len(kept)} removed, "
+            f"{len(kept) - reused} changed, {reused} reused."
+        )
+
     # Export DataFrames to CSV
     nodes_df.to_csv(f"{filename}_nodes.csv", index=False)
     edges_df.to_csv(f"{filename}_edges.csv", index=False)
@@ -177,6 +326,250 @@ def export_to_csv(graph, center, filename):
     return (nodes_df, edges_df)
 
 
+CompactNetwork = namedtuple(
+    "CompactNetwork",
+    [
+        "node_ids",  # int64 OSM ids, sorted; position is the node index
+        "node_lat",  # float64
+        "node_lon",  # float64
+        "edge_u",  # int32 node index, edges sorted by (u, v, key)
+        "edge_v",  # int32 node index
+        "edge_key",  # int32
+        "edge_length",  # float64
+        "edge_highway",  # int32 code into `highways`
+        "edge_name",  # int32 code into `names`, -1 when unnamed
+        "highways",
+        "names",
+    ],
+)
+
+
+def strings_nbytes(strings):
+    return sys.getsizeof(strings) + sum(sys.getsizeof(x) for x in strings)
+
+
+def network_nbytes(net):
+    """
+    Memory held by a CompactNetwork: its arrays and name tables.
+    """
+    return sum(
+        f.nbytes if isinstance(f, np.ndarray) else strings_nbytes(f) for f in net
+    )
+
+
+def rows_nbytes(rows):
+    """
+    Memory held by a {name: row} dict such as load_previous_edges returns.
+    """
+    return sys.getsizeof(rows) + sum(
+        sys.getsizeof(r) + sum(sys.getsizeof(x) for x in r) for r in rows.values()
+    )
+
+
+def compaction_peak_estimate(n, m):
+    """
+    Upper estimate of the peak memory of compact_graph on a graph with n nodes
+    and m edges, counting the graph itself, which is only freed at the end.
+    """
+    graph = n * GRAPH_NODE_BYTES + m * GRAPH_EDGE_BYTES
+    nodes = n * (3 * 8 + INDEX_ENTRY_BYTES)
+    # Edge arrays exist twice while being reordered, plus the int64 order.
+    edges = m * (2 * (5 * 4 + 8) + 8)
+    # Name lookup dicts and the lists built from them, at most one entry per edge.
+    names = 2 * m * NAME_BYTES_ESTIMATE
+    return graph + nodes + edges + names
+
+
+def compact_graph(graph):
+    """
+    Convert an OSMnx graph into a CompactNetwork.
+    Attribute dicts are cleared as they are read, and the graph is emptied
+    afterwards, so it can be freed as soon as possible.
+    """
+
+    n = graph.number_of_nodes()
+    m = graph.number_of_edges()
+
+    node_ids = np.fromiter(graph.nodes, dtype=np.int64, count=n)
+    node_ids.sort()
+    index = {nid: i for i, nid in enumerate(node_ids.tolist())}
+
+    node_lat = np.empty(n, dtype=np.float64)
+    node_lon = np.empty(n, dtype=np.float64)
+    for nid, data in graph.nodes(data=True):
+        i = index[nid]
+        node_lat[i] = data["y"]
+        node_lon[i] = data["x"]
+        data.clear()
+
+    edge_u = np.empty(m, dtype=np.int32)
+    edge_v = np.empty(m, dtype=np.int32)
+    edge_key = np.empty(m, dtype=np.int32)
+    edge_length = np.empty(m, dtype=np.float64)
+    edge_highway = np.empty(m, dtype=np.int32)
+    edge_name = np.empty(m, dtype=np.int32)
+    highways = {}
+    names = {}
+
+    for j, (u, v, key, data) in enumerate(graph.edges(keys=True, data=True)):
+        edge_u[j] = index[u]
+        edge_v[j] = index[v]
+        edge_key[j] = key
+        edge_length[j] = data["length"]
+        edge_highway[j] = highways.setdefault(tag_str(data["highway"]), len(highways))
+        if "name" in data:
+            edge_name[j] = names.setdefault(tag_str(data["name"]), len(names))
+        else:
+            edge_name[j] = -1
+        data.clear()
+
+    graph.clear()
+
+    order = np.lexsort((edge_key, edge_v, edge_u))
+    net = CompactNetwork(
+        node_ids,
+        node_lat,
+        node_lon,
+        edge_u[order],
+        edge_v[order],
+        edge_key[order],
+        edge_length[order],
+        edge_highway[order],
+        edge_name[order],
+        list(highways),
+        list(names),
+    )
+    logger.info(
+        f"Compacted graph to {n} nodes, {m} edges, {network_nbytes(net)} bytes."
+    )
+    return net
+
+
+def compact_nodes(net, chunk_size):
+    """
+    Yield (node_id, data) nodes from a CompactNetwork, a chunk at a time.
+    """
+    for s in range(0, len(net.node_ids), chunk_size):
+        e = s + chunk_size
+        for nid, y, x in zip(
+            net.node_ids[s:e].tolist(),
+            net.node_lat[s:e].tolist(),
+            net.node_lon[s:e].tolist(),
+        ):
+            yield (nid, {"y": y, "x": x})
+
+
+def compact_edges(net, chunk_size):
+    """
+    Yield (u, v, key, data) edges from a CompactNetwork, in (u, v, key) order.
+    Only a chunk of the arrays is converted to Python objects at a time.
+    """
+    for s in range(0, len(net.edge_u), chunk_size):
+        e = s + chunk_size
+        us = net.node_ids[net.edge_u[s:e]].tolist()
+        vs = net.node_ids[net.edge_v[s:e]].tolist()
+        for u, v, key, length, hw, nm in zip(
+            us,
+            vs,
+            net.edge_key[s:e].tolist(),
+            net.edge_length[s:e].tolist(),
+            net.edge_highway[s:e].tolist(),
+            net.edge_name[s:e].tolist(),
+        ):
+            data = {"length": length, "highway": net.highways[hw]}
+            if nm >= 0:
+                data["name"] = net.names[nm]
+            yield (u, v, key, data)
+
+
+def write_chunked(fp, columns, rows, chunk_size):
+    """
+    Write rows to a csv file chunk_size rows at a time.
+    """
+    count = 0
+    with open(fp, "w", newline="") as f:
+        # Same line endings as DataFrame.to_csv, so both export modes match.
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(columns)
+        for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+            writer.writerows(chunk)
+            count += len(chunk)
+    return count
+
+
+def export_streaming(
+    graph,
+    center,
+    filename,
+    incremental=False,
+    chunk_size=EXPORT_CHUNK_SIZE,
+    memory_limit_mb=EXPORT_MEMORY_LIMIT_MB,
+):
+    """
+    Export a graph into the same two csv files as export_to_csv, streaming
+    rows in chunks from a CompactNetwork instead of building DataFrames.
+    The graph is emptied in the process.
+    Raises MemoryError, before compacting, if the estimated peak exceeds
+    memory_limit_mb; otherwise the chunk size is shrunk as needed to fit.
+    The graph is already built by then, so its download is not covered.
+    """
+
+    limit = memory_limit_mb * 2**20
+    n, m = graph.number_of_nodes(), graph.number_of_edges()
+    peak = compaction_peak_estimate(n, m)
+    if peak > limit:
+        raise MemoryError(
+            f"Compacting {n} nodes and {m} edges needs about {peak / 2**20:.1f} MB, "
+            f"over the {memory_limit_mb} MB export limit."
+        )
+
+    net = compact_graph(graph)
+    budget = limit - network_nbytes(net)
+    if budget < ROW_BYTES_ESTIMATE:
+        raise MemoryError(
+            f"Compact network alone exceeds the {memory_limit_mb} MB export limit."
+        )
+
+    previous = {}
+    if incremental:
+        fp = f"{filename}_edges.csv"
+        # Upper bound on previous rows, assuming at least 64 bytes per line.
+        n_prev = os.path.getsize(fp) // 64 if os.path.exists(fp) else 0
+        # Generation is deterministic, so skipping reuse still gives the same rows.
+        if n_prev * ROW_BYTES_ESTIMATE > budget // 2:
+            logger.warn("Previous export too large to reuse within memory limit.")
+        else:
+            previous = load_previous_edges(filename)
+            budget -= rows_nbytes(previous)
+
+    chunk_size = max(1, min(chunk_size, budget // ROW_BYTES_ESTIMATE))
+    logger.info(f"Streaming export in chunks of {chunk_size} rows.")
+
+    n_nodes = write_chunked(
+        f"{filename}_nodes.csv",
+        ["node_id", "x", "y"],
+        node_proc(compact_nodes(net, chunk_size), center),
+        chunk_size,
+    )
+    n_edges = write_chunked(
+        f"{filename}_edges.csv",
+        EDGE_COLUMNS,
+        edge_proc(compact_edges(net, chunk_size), previous),
+        chunk_size,
+    )
+    logger.info(f"Streamed {n_nodes} nodes and {n_edges} edges to {filename}.")
+    return (n_nodes, n_edges)
+
+
+def drop_geometry(graph):
+    """
+    Remove edge geometries, which OSMnx builds while simplifying but the
+    exporters never use.
+    """
+    for _, _, data in graph.edges(data=True):
+        data.pop("geometry", None)
+
+
 def find_graph(addr: str):
     logger.info("Querying graph from OSM.")
     s = ox.graph_from_address(
@@ -190,6 +583,7 @@ def find_graph(addr: str):
         custom_filter=FILTER,
     )
     logger.info("Obtained result.")
+    drop_geometry(s)
     loc = get_lat_lon(addr)
     return s, loc
 
@@ -207,22 +601,45 @@ def find_graph_from_loc(point):
         custom_filter=FILTER,
     )
     logger.info("Obtained result.")
+    drop_geometry(s)
     return s
 
 
-def process_address(addr):
+def export_graph(
+    graph,
+    center,
+    filename,
+    incremental=False,
+    streaming=False,
+    memory_limit_mb=EXPORT_MEMORY_LIMIT_MB,
+):
+    if streaming:
+        export_streaming(
+            graph, center, filename, incremental, memory_limit_mb=memory_limit_mb
+        )
+    else:
+        export_to_csv(graph, center, filename, incremental)
+
+
+def process_address(
+    addr, incremental=False, streaming=False, memory_limit_mb=EXPORT_MEMORY_LIMIT_MB
+):
     graph, loc = find_graph(addr)
     logger.info("Collecting and Exporting to CSV..")
-    ndf, edf = export_to_csv(graph, loc, "osm/map")
+    export_graph(graph, loc, "osm/map", incremental, streaming, memory_limit_mb)
+    del graph
     logger.info("Converting raw_demands.csv global co-ords to local.")
     convert_coords("raw_demands.csv", "osm/area_demands.csv", local_coords, loc)
     return loc
 
 
-def process_coords(point):
-    graph = find_graph(point)
+def process_coords(
+    point, incremental=False, streaming=False, memory_limit_mb=EXPORT_MEMORY_LIMIT_MB
+):
+    graph = find_graph_from_loc(point)
     logger.info("Collecting and Exporting to CSV..")
-    ndf, edf = export_to_csv(graph, point, "osm/map")
+    export_graph(graph, point, "osm/map", incremental, streaming, memory_limit_mb)
+    del graph
     logger.info("Converting raw_demands.csv global co-ords to local.")
     convert_coords("raw_demands.csv", "osm/area_demands.csv", local_coords, point)
     return point
@@ -0,0 +1,310 @@
+"""
+Surrogate model of the traffic simulation.
+
+Every completed run of `main.routine` is logged together with the slider
+parameters and a few features of the exported network.  A Gaussian process
+is fit on those runs, so what-if queries close to something already
+simulated can be answered with a prediction (and its uncertainty) instead
+of a full simulation.
+"""
+
+import csv
+import logging
+import os
+
+import numpy as np
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import RBF, ConstantKernel, WhiteKernel
+from sklearn.preprocessing import StandardScaler
+
+import osm2csv as ocv
+from demparser import parse_demands
+
+logger = logging.getLogger(__name__)
+
+#########SETTINGS########################
+
+RUNS_FILE = "surrogate_runs.csv"
+# Log of completed simulation runs the surrogate is trained on.
+
+MIN_RUNS = 8
+# Below this many runs, always simulate.
+
+MAX_RELATIVE_STD = 0.1
+# Simulate when any metric's predicted std exceeds this fraction of its mean.
+
+PARAM_COLUMNS = [
+    "rad_dist",
+    "global_mean_jam_density",
+    "jam_density_variance",
+    "freeflow_speed_variance",
+    "freeflow_mean_shiftcoef",
+]
+
+FEATURE_COLUMNS = [
+    "n_nodes",
+    "n_links",
+    "total_length",
+    "mean_free_flow_speed",
+    "mean_jam_density",
+    "n_demands",
+]
+
+METRIC_COLUMNS = [
+    "trip_all",
+    "trip_completed",
+    "average_travel_time",
+    "average_delay",
+]
+
+##########################################
+
+
+def current_params():
+    """
+    Return the attribute generation parameters currently set in osm2csv.
+    """
+    return {
+        "rad_dist": ocv.RAD_DIST,
+        "global_mean_jam_density": ocv.GLOBAL_MEAN_JAM_DENSITY,
+        "jam_density_variance": ocv.JAM_DENSITY_VARIANCE,
+        "freeflow_speed_variance": ocv.FREEFLOW_SPEED_VARIANCE,
+        "freeflow_mean_shiftcoef": ocv.FREEFLOW_MEAN_SHIFTCOEF,
+    }
+
+
+def network_features(
+    nodes_fp="osm/map_nodes.csv",
+    edges_fp="osm/map_edges.csv",
+    demands_fp="osm/area_demands.csv",
+):
+    """
+    Summarise an exported network (and its demands) into a few scalar features.
+    """
+    with open(nodes_fp) as f:
+        n_nodes = sum(1 for _ in csv.DictReader(f))
+
+    n_links = 0
+    total_length = 0.0
+    total_ffs = 0.0
+    total_jd = 0.0
+    with open(edges_fp) as f:
+        for r in csv.DictReader(f):
+            try:
+                length = float(r["length"])
+                ffs = float(r["free_flow_speed"])
+                jd = float(r["jam_density"])
+            except (KeyError, ValueError) as e:
+                logger.warn(f"Skipping link {r} in features, cause: {e}")
+                continue
+            n_links += 1
+            total_length += length
+            total_ffs += ffs
+            total_jd += jd
+
+    n_demands = 0
+    if os.path.exists(demands_fp):
+        n_demands = sum(len(outs) for _, outs in parse_demands(demands_fp))
+
+    return {
+        "n_nodes": n_nodes,
+        "n_links": n_links,
+        "total_length": total_length,
+        "mean_free_flow_speed": total_ffs / n_links if n_links else 0.0,
+        "mean_jam_density": total_jd / n_links if n_links else 0.0,
+        "n_demands": n_demands,
+    }
+
+
+def rescale_features(features, exported_params, params):
+    """
+    Features of an already exported network, as if it had been exported
+    with `params` instead of `exported_params`.
+
+    Jam density and free-flow speed are drawn around means set by the
+    params, so their averages can be shifted without re-exporting.
+    """
+    out = dict(features)
+    out["mean_jam_density"] = params["global_mean_jam_density"]
+    if ocv.FUDGE_IDEAL_VALUES and features["n_links"]:
+        mean_length = features["total_length"] / features["n_links"]
+        out["mean_free_flow_speed"] += (
+            params["freeflow_mean_shiftcoef"]
+            - exported_params["freeflow_mean_shiftcoef"]
+        ) * mean_length
+    return out
+
+
+def run_metrics(W):
+    """
+    Extract the headline congestion metrics from a finished World.
+    """
+    W.analyzer.basic_analysis()
+    return {m: float(getattr(W.analyzer, m)) for m in METRIC_COLUMNS}
+
+
+def record_run(params, features, metrics, fp=RUNS_FILE):
+    """
+    Append a completed run to the surrogate's training log.
+    Runs where no trip completed are skipped: UXsim reports their average
+    travel time and delay as -1, which is not a real observation.
+    """
+    if metrics["trip_completed"] == 0:
+        logger.info("No trips completed, not recording run for surrogate.")
+        return None
+
+    row = {**params, **features, **metrics}
+    new_file = not os.path.exists(fp) or os.path.getsize(fp) == 0
+    with open(fp, "a", newline="") as f:
+        writer = csv.DictWriter(
+            f, fieldnames=PARAM_COLUMNS + FEATURE_COLUMNS + METRIC_COLUMNS
+        )
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+    logger.info(f"Recorded run for surrogate: {row}")
+    return row
+
+
+class Surrogate:
+    """
+    Gaussian process surrogate mapping (params, network features) to metrics.
+
+    One regressor is kept per metric.  `refresh` picks up runs appended to
+    the log since the last call and refits, starting from the previously
+    learnt kernel hyperparameters so the update stays cheap.
+    """
+
+    def __init__(self, fp=RUNS_FILE):
+        self.fp = fp
+        self.X = []
+        self.Y = []
+        self.scaler = None
+        self.models = {}
+        self.kernels = {}
+
+    @staticmethod
+    def _x(params, features):
+        return [float(params[c]) for c in PARAM_COLUMNS] + [
+            float(features[c]) for c in FEATURE_COLUMNS
+        ]
+
+    def refresh(self):
+        """
+        Load runs added to the log since the last refresh and refit if needed.
+        Returns the number of new runs.
+        """
+        if not os.path.exists(self.fp):
+            return 0
+
+        added = 0
+        with open(self.fp, newline="") as f:
+            for i, r in enumerate(csv.DictReader(f)):
+                if i < len(self.X):
+                    continue
+                try:
+                    x = self._x(r, r)
+                    y = [float(r[m]) for m in METRIC_COLUMNS]
+                    if float(r["trip_completed"]) == 0:
+                        raise ValueError("no trips completed")
+                except (KeyError, ValueError) as e:
+                    logger.warn(f"Skipping unusable surrogate row {r}, cause: {e}")
+                    x, y = None, None
+                # Keep row indices aligned with the file, even for bad rows.
+                self.X.append(x)
+                self.Y.append(y)
+                added += 1
+
+        if added:
+            logger.info(f"Surrogate picked up {added} new runs.")
+            self.fit()
+        return added
+
+    def _rows(self):
+        rows = [(x, y) for x, y in zip(self.X, self.Y) if x is not None]
+        return (
+            np.array([x for x, _ in rows], dtype=float),
+            np.array([y for _, y in rows], dtype=float),
+        )
+
+    def fit(self):
+        X, Y = self._rows()
+        if len(X) < MIN_RUNS:
+            logger.info(f"Only {len(X)} runs, not fitting surrogate yet.")
+            self.models = {}
+            return
+
+        self.scaler = StandardScaler().fit(X)
+        Xs = self.scaler.transform(X)
+
+        for j, m in enumerate(METRIC_COLUMNS):
+            kernel = self.kernels.get(m)
+            if kernel is None:
+                kernel = ConstantKernel() * RBF(
+                    length_scale=np.ones(X.shape[1])
+                ) + WhiteKernel()
+                restarts = 2
+            else:
+                restarts = 0
+            gp = GaussianProcessRegressor(
+                kernel=kernel,
+                normalize_y=True,
+                n_restarts_optimizer=restarts,
+                random_state=0,
+            )
+            gp.fit(Xs, Y[:, j])
+            self.models[m] = gp
+            self.kernels[m] = gp.kernel_
+
+        logger.info(f"Fit surrogate on {len(X)} runs.")
+
+    def ready(self):
+        return bool(self.models)
+
+    def predict(self, params, features):
+        """
+        Predict every metric, returning a dict of metric -> (mean, std).
+        """
+        if not self.ready():
+            raise RuntimeError("Surrogate has not been fit yet.")
+
+        xs = self.scaler.transform(np.array([self._x(params, features)]))
+        out = {}
+        for m, gp in self.models.items():
+            mean, std = gp.predict(xs, return_std=True)
+            out[m] = (float(mean[0]), float(std[0]))
+        return out
+
+    def in_domain(self, params, features):
+        """
+        Whether the query lies inside the box spanned by the training runs.
+        """
+        X, _ = self._rows()
+        x = np.array(self._x(params, features))
+        return bool(np.all(x >= X.min(axis=0)) and np.all(x <= X.max(axis=0)))
+
+    def needs_simulation(self, params, features):
+        """
+        Decide whether a real simulation is needed for this query.
+
+        Returns (needed, prediction); prediction is None when not available.
+        """
+        if not self.ready():
+            return True, None
+
+        if not self.in_domain(params, features):
+            logger.info("Query outside surrogate training domain.")
+            return True, None
+
+        pred = self.predict(params, features)
+        for m, (mean, std) in pred.items():
+            if std > MAX_RELATIVE_STD * max(abs(mean), 1.0):
+                logger.info(f"Surrogate uncertain on {m}: {mean} +/- {std}")
+                return True, pred
+        return False, pred
+
+
+def format_prediction(pred):
+    return "\n".join(
+        f"{m}: {mean:.2f} ± {std:.2f}" for m, (mean, std) in pred.items()
+    )
@@ -0,0 +1,66 @@
+"""
+Checks that osm2csv exports of the same area are byte-identical.
+"""
+
+import networkx as nx
+import pytest
+
+import osm2csv as ocv
+
+CENTER = (13.0, 77.5)
+
+
+def make_graph(flip):
+    """
+    A small graph with list-valued tags, as OSMnx produces for simplified
+    edges. `flip` reverses list tags and insertion order, as a different
+    PYTHONHASHSEED or download would.
+    """
+    names = ["8th Main Road", "11th Main Road"]
+    highways = ["primary", "secondary"]
+    nodes = [(5, 13.0, 77.5), (3, 13.01, 77.51), (9, 13.0, 77.52)]
+    edges = [
+        (5, 3, {"length": 10.5, "highway": "primary", "name": "Sampige Road"}),
+        (3, 9, {"length": 7.0, "highway": highways, "name": names}),
+        (9, 5, {"length": 12.0, "highway": "residential"}),
+    ]
+    if flip:
+        names.reverse()
+        highways.reverse()
+        nodes.reverse()
+        edges.reverse()
+
+    g = nx.MultiDiGraph()
+    for n, y, x in nodes:
+        g.add_node(n, y=y, x=x)
+    for u, v, data in edges:
+        g.add_edge(u, v, key=0, **data)
+    return g
+
+
+def export(tmp_path, graph, streaming, incremental=False):
+    tmp_path.mkdir(exist_ok=True)
+    filename = str(tmp_path / "map")
+    ocv.export_graph(graph, CENTER, filename, incremental, streaming)
+    return [
+        open(f"{filename}_{part}.csv", "rb").read() for part in ("nodes", "edges")
+    ]
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_export_ignores_list_tag_order(tmp_path, streaming):
+    first = export(tmp_path / "a", make_graph(False), streaming)
+    second = export(tmp_path / "b", make_graph(True), streaming)
+    assert first == second
+
+
+def test_streaming_matches_dataframe_export(tmp_path):
+    frame = export(tmp_path / "a", make_graph(False), streaming=False)
+    streamed = export(tmp_path / "b", make_graph(False), streaming=True)
+    assert frame == streamed
+
+
+def test_incremental_reexport_is_unchanged(tmp_path):
+    first = export(tmp_path, make_graph(False), streaming=False)
+    again = export(tmp_path, make_graph(True), streaming=False, incremental=True)
+    assert first == again